@@ -1,21 +1,56 @@
+import heapq
+import hmac
 import os
-from datetime import datetime, timedelta
-from itertools import combinations
+from datetime import date, timedelta
 from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 from flask import Flask, render_template, jsonify, request, session
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
-from config import PROVIDER_PRICES, WATCH_REGION, MY_PLATFORMS
+from config import PROVIDER_PRICES, WATCH_REGION, MY_PLATFORMS, ADMIN_TOKEN
 from services.tmdb import TMDBService, TMDBError
 from db import (load_watchlist, add_to_watchlist, remove_from_watchlist,
                 migrate_json_watchlist, create_user, get_user_by_email,
                 get_user_by_id, verify_user, merge_watchlist)
 
+
+class ORJSONProvider(JSONProvider):
+    """Route jsonify() and request.json through orjson (large TMDB payloads)."""
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option),
+                                        mimetype='application/json')
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
+
+# Gzip JSON responses — optimizer/calendar/person payloads shrink 5–10×
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 512
+app.config['COMPRESS_LEVEL'] = 4
+Compress(app)
+
 tmdb = TMDBService()
 
+# Shared pool for parallel TMDB calls. The work is network-bound, so it is
+# sized well above the CPU count and reused across requests (never shut down).
+IO_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix='tmdb-io')
+
 # Migrate any existing JSON watchlist to SQLite on startup
 migrate_json_watchlist()
 
@@ -59,22 +94,19 @@ def search():
     if not query:
         return jsonify({'results': [], 'total_pages': 0, 'page': 1})
 
+    # TMDB payloads are cached and shared, so tag copies rather than mutating
     if media_type == 'movie':
         data = tmdb.search_movie(query, page)
-        for r in data.get('results', []):
-            r['media_type'] = 'movie'
+        results = [dict(r, media_type='movie') for r in data.get('results', [])]
     elif media_type == 'tv':
         data = tmdb.search_tv(query, page)
-        for r in data.get('results', []):
-            r['media_type'] = 'tv'
+        results = [dict(r, media_type='tv') for r in data.get('results', [])]
     else:
         data = tmdb.search_multi(query, page)
+        results = data.get('results', [])
 
     # Filter to movies and TV only (drop "person" results from multi)
-    results = [
-        r for r in data.get('results', [])
-        if r.get('media_type') in ('movie', 'tv')
-    ]
+    results = [r for r in results if r.get('media_type') in ('movie', 'tv')]
 
     return jsonify({
         'results': results,
@@ -98,7 +130,9 @@ def get_details(media_type, title_id):
     else:
         data = tmdb.get_tv_details(title_id)
 
-    # Reshape watch/providers into a cleaner structure
+    # Reshape watch/providers into a cleaner structure (on a copy — the
+    # TMDB payload is shared through the response cache)
+    data = dict(data)
     wp = data.pop('watch/providers', {}).get('results', {})
     data['watch_providers'] = {
         'eg': wp.get(WATCH_REGION, {}),
@@ -115,8 +149,8 @@ def get_details(media_type, title_id):
 @app.route('/api/person/<int:person_id>')
 def get_person(person_id):
     data = tmdb.get_person(person_id)
-    cast_credits = data.get('combined_credits', {}).get('cast', [])
-    cast_credits.sort(key=lambda x: x.get('vote_count', 0), reverse=True)
+    filmography = heapq.nlargest(30, data.get('combined_credits', {}).get('cast', []),
+                                 key=lambda x: x.get('vote_count', 0) or 0)
 
     return jsonify({
         'id': data['id'],
@@ -126,7 +160,7 @@ def get_person(person_id):
         'birthday': data.get('birthday'),
         'place_of_birth': data.get('place_of_birth'),
         'known_for_department': data.get('known_for_department'),
-        'filmography': cast_credits[:30],
+        'filmography': filmography,
     })
 
 
@@ -134,9 +168,8 @@ def get_person(person_id):
 def get_person_availability(person_id):
     """Filmography with Egyptian streaming availability (parallelised)."""
     data = tmdb.get_person(person_id)
-    credits = data.get('combined_credits', {}).get('cast', [])
-    credits.sort(key=lambda x: x.get('vote_count', 0), reverse=True)
-    credits = credits[:20]
+    credits = heapq.nlargest(20, data.get('combined_credits', {}).get('cast', []),
+                             key=lambda x: x.get('vote_count', 0) or 0)
 
     def _fetch(credit):
         mt = credit.get('media_type', 'movie')
@@ -157,8 +190,7 @@ def get_person_availability(person_id):
             'available_in_egypt': bool(eg.get('flatrate')),
         }
 
-    with ThreadPoolExecutor(max_workers=5) as pool:
-        filmography = list(pool.map(_fetch, credits))
+    filmography = list(IO_POOL.map(_fetch, credits))
 
     return jsonify({
         'person': {
@@ -278,6 +310,64 @@ def auth_me():
 # Subscription Optimizer
 # ---------------------------------------------------------------------------
 
+def _greedy_cover(masks, n):
+    """Pick *n* provider positions, each adding the most new titles."""
+    picked, mask = [], 0
+    remaining = list(range(len(masks)))
+    for _ in range(n):
+        i = max(remaining, key=lambda j: (mask | masks[j]).bit_count())
+        remaining.remove(i)
+        picked.append(i)
+        mask |= masks[i]
+    # Keep the same platform order the exhaustive search would produce
+    return tuple(sorted(picked))
+
+
+def _best_cover(masks, prices, n, seed):
+    """Branch-and-bound search for the *n* providers covering the most titles.
+
+    *masks* and *prices* are indexed by provider position, sorted by
+    descending coverage; *seed* is an incumbent combination of positions.
+    Ties on coverage go to the cheaper combination. Returns
+    ``(positions, mask, coverage, cost)``.
+    """
+    pops = [m.bit_count() for m in masks]
+    seed_mask = 0
+    for i in seed:
+        seed_mask |= masks[i]
+    best = [seed, seed_mask, seed_mask.bit_count(), sum(prices[i] for i in seed)]
+    picked = []
+
+    def extend(start, mask, cost, picks_left):
+        covered = mask.bit_count()
+        if not picks_left:
+            if covered > best[2] or (covered == best[2] and cost < best[3]):
+                best[:] = [tuple(picked), mask, covered, cost]
+            return
+        for i in range(start, len(masks) - picks_left + 1):
+            # No provider from i on adds more than pops[i] titles, and the
+            # bound only shrinks as i grows — so once it fails, stop here.
+            bound = covered + picks_left * pops[i]
+            if bound < best[2] or (bound == best[2] and cost >= best[3]):
+                return
+            picked.append(i)
+            extend(i + 1, mask | masks[i], cost + prices[i], picks_left - 1)
+            picked.pop()
+
+    extend(0, 0, 0, n)
+    return tuple(best)
+
+
+def _mask_titles(mask, titles):
+    """Return the titles whose bits are set in *mask*, in watchlist order."""
+    covered = []
+    while mask:
+        low = mask & -mask
+        covered.append(titles[low.bit_length() - 1]['title'])
+        mask ^= low
+    return covered
+
+
 @app.route('/api/optimize')
 def optimize():
     watchlist = load_watchlist(get_user_id())
@@ -294,8 +384,7 @@ def optimize():
         except Exception:
             return item, []
 
-    with ThreadPoolExecutor(max_workers=5) as pool:
-        results = list(pool.map(_fetch, watchlist))
+    results = list(IO_POOL.map(_fetch, watchlist))
 
     for item, flatrate in results:
         key = f"{item['media_type']}_{item['id']}"
@@ -316,43 +405,36 @@ def optimize():
             'providers': pids,
         }
 
-    # --- Set-cover optimisation (brute-force, fine for <=15 platforms) ---
-    platform_ids = list(all_providers.keys())
-    total = len(title_providers)
+    # --- Set-cover optimisation ---
+    # Each provider gets a bitmask of the titles it streams (bit i = title i),
+    # so the coverage of a combination is the popcount of its OR-ed masks.
+    titles = list(title_providers.values())
+    provider_mask = dict.fromkeys(all_providers, 0)
+    for i, d in enumerate(titles):
+        for pid in d['providers']:
+            provider_mask[pid] |= 1 << i
+
+    # Strongest providers first so the greedy seed and pruning bite early
+    platform_ids = sorted(all_providers, key=lambda p: provider_mask[p].bit_count(),
+                          reverse=True)
+    masks = [provider_mask[p] for p in platform_ids]
+    prices = [all_providers[p]['price'] or 0 for p in platform_ids]
+    total = len(titles)
     combos = []
     max_n = min(5, len(platform_ids))
 
     for n in range(1, max_n + 1):
-        best_combo = None
-        best_coverage = 0
-        best_cost = float('inf')
-        best_covered = []
-
-        for combo in combinations(platform_ids, n):
-            covered = [
-                d['title'] for d in title_providers.values()
-                if any(p in combo for p in d['providers'])
-            ]
-            cost = sum(all_providers[p].get('price') or 0 for p in combo)
-
-            if len(covered) > best_coverage or (
-                len(covered) == best_coverage and cost < best_cost
-            ):
-                best_combo = combo
-                best_coverage = len(covered)
-                best_cost = cost
-                best_covered = covered
-
-        if best_combo:
-            combos.append({
-                'num_platforms': n,
-                'platforms': [all_providers[p] for p in best_combo],
-                'coverage': best_coverage,
-                'total': total,
-                'percentage': round(best_coverage / total * 100, 1) if total else 0,
-                'monthly_cost': best_cost,
-                'covered_titles': best_covered,
-            })
+        picks, mask, coverage, cost = _best_cover(masks, prices, n,
+                                                  _greedy_cover(masks, n))
+        combos.append({
+            'num_platforms': n,
+            'platforms': [all_providers[platform_ids[i]] for i in picks],
+            'coverage': coverage,
+            'total': total,
+            'percentage': round(coverage / total * 100, 1) if total else 0,
+            'monthly_cost': cost,
+            'covered_titles': _mask_titles(mask, titles),
+        })
 
     not_available = [
         d['title'] for d in title_providers.values() if not d['providers']
@@ -382,27 +464,33 @@ def calendar():
         return jsonify({'episodes': [], 'shows': 0,
                         'message': 'No TV shows in your watchlist.'})
 
-    today = datetime.now().date()
+    today = date.today()
     cutoff = today + timedelta(days=CALENDAR_DAYS)
-
-    def _fetch_episodes(item):
-        """Get upcoming episodes for a single show."""
-        episodes = []
+    # ISO dates order correctly as strings, so most episodes can be placed
+    # relative to the window without parsing them at all
+    today_iso, cutoff_iso = today.isoformat(), cutoff.isoformat()
+    dormant_iso = (today - timedelta(days=365)).isoformat()
+
+    def _plan_show(item):
+        """Fetch basic info for a show and pick the seasons worth scanning."""
+        # Isolate each show: odd TMDB data must not fail the whole calendar
         try:
             show = tmdb.get_tv_basic(item['id'])
-            show_name = show.get('name', item.get('title', 'Unknown'))
-            poster = show.get('poster_path') or item.get('poster_path')
-            status = show.get('status', '')
 
             # Skip ended / cancelled shows
-            if status in ('Ended', 'Canceled'):
-                return episodes
+            if show.get('status', '') in ('Ended', 'Canceled'):
+                return None
 
             # Determine which seasons might have future episodes.
             # Check next_episode_to_air first — fastest path.
             next_ep = show.get('next_episode_to_air')
             seasons_to_check = set()
 
+            # Nothing announced and nothing aired for a year — treat as dormant
+            last_air = show.get('last_air_date') or ''
+            if not next_ep and last_air and last_air < dormant_iso:
+                return None
+
             if next_ep and next_ep.get('season_number'):
                 seasons_to_check.add(next_ep['season_number'])
 
@@ -410,30 +498,45 @@ def calendar():
             all_seasons = show.get('seasons', [])
             if all_seasons:
                 # Grab the last 2 real seasons (season_number > 0)
-                real = [s for s in all_seasons if s.get('season_number', 0) > 0]
+                real = [s for s in all_seasons if (s.get('season_number') or 0) > 0]
                 for s in real[-2:]:
                     seasons_to_check.add(s['season_number'])
 
-            for sn in seasons_to_check:
-                try:
-                    season_data = tmdb.get_season(item['id'], sn)
-                except Exception:
-                    continue
+            if not seasons_to_check:
+                return None
+
+            meta = {
+                'show_id': item['id'],
+                'show_name': show.get('name', item.get('title', 'Unknown')),
+                'show_poster': show.get('poster_path') or item.get('poster_path'),
+            }
+            return meta, seasons_to_check
+        except Exception:
+            return None
+
+    def _fetch_episodes(job):
+        """Get upcoming episodes from the chosen seasons of one show."""
+        meta, seasons_to_check = job
+        episodes = []
+        # Isolate each show: odd TMDB data must not fail the whole calendar
+        try:
+            seasons = tmdb.get_seasons(meta['show_id'], seasons_to_check)
 
+            for sn, season_data in seasons.items():
                 for ep in season_data.get('episodes', []):
                     air = ep.get('air_date')
-                    if not air:
+                    if not air or air < today_iso:
                         continue
+                    if air > cutoff_iso:
+                        break  # episodes are in airing order — the rest are later
                     try:
-                        air_date = datetime.strptime(air, '%Y-%m-%d').date()
+                        air_date = date.fromisoformat(air)
                     except ValueError:
                         continue
 
                     if today <= air_date <= cutoff:
                         episodes.append({
-                            'show_id': item['id'],
-                            'show_name': show_name,
-                            'show_poster': poster,
+                            **meta,
                             'season_number': ep.get('season_number', sn),
                             'episode_number': ep.get('episode_number', 0),
                             'name': ep.get('name', ''),
@@ -445,11 +548,13 @@ def calendar():
             pass
         return episodes
 
+    # Two flat rounds on the shared pool — every show's basics, then one
+    # append_to_response call per show for all the seasons it needs — so
+    # each show costs two TMDB round trips however many seasons are checked.
+    jobs = [job for job in IO_POOL.map(_plan_show, tv_shows) if job]
     all_episodes = []
-    with ThreadPoolExecutor(max_workers=5) as pool:
-        results = pool.map(_fetch_episodes, tv_shows)
-        for eps in results:
-            all_episodes.extend(eps)
+    for eps in IO_POOL.map(_fetch_episodes, jobs):
+        all_episodes.extend(eps)
 
     # Sort by air date
     all_episodes.sort(key=lambda e: e['air_date'])
@@ -465,14 +570,21 @@ def calendar():
 # Provider catalogue (helper to discover IDs & configure prices)
 # ---------------------------------------------------------------------------
 
-@app.route('/api/providers')
-def list_providers():
-    """List all streaming providers available in Egypt."""
-    movie_p = tmdb.get_available_providers('movie').get('results', [])
-    tv_p = tmdb.get_available_providers('tv').get('results', [])
+# The merged catalogue is a pure function of the two TMDB provider lists and
+# PROVIDER_PRICES. TMDBService pins those lists for a day, so the merged
+# result is rebuilt only when it hands back new ones: (movie, tv, result).
+_provider_catalogue = {'cached': (None, None, None)}
+
+
+def _get_provider_catalogue():
+    movie_data = tmdb.get_available_providers('movie')
+    tv_data = tmdb.get_available_providers('tv')
+    cached_movie, cached_tv, result = _provider_catalogue['cached']
+    if cached_movie is movie_data and cached_tv is tv_data:
+        return result
 
     merged = {}
-    for p in movie_p + tv_p:
+    for p in movie_data.get('results', []) + tv_data.get('results', []):
         merged[p['provider_id']] = p
 
     result = []
@@ -486,7 +598,46 @@ def list_providers():
             'configured': pid in PROVIDER_PRICES,
         })
 
-    return jsonify(result)
+    _provider_catalogue['cached'] = (movie_data, tv_data, result)
+    return result
+
+
+def _warm_provider_catalogue():
+    try:
+        _get_provider_catalogue()
+    except Exception:
+        pass  # e.g. no API key yet — /api/providers will retry on demand
+
+
+# Warm the catalogue in the background so the first visitor doesn't wait
+IO_POOL.submit(_warm_provider_catalogue)
+
+
+@app.route('/api/providers')
+def list_providers():
+    """List all streaming providers available in Egypt."""
+    return jsonify(_get_provider_catalogue())
+
+
+# ---------------------------------------------------------------------------
+# Cache admin
+# ---------------------------------------------------------------------------
+
+def is_admin():
+    """True in debug mode, or when X-Admin-Token matches ADMIN_TOKEN."""
+    if app.debug:
+        return True
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+@app.route('/api/_cache/clear', methods=['POST'])
+def clear_cache():
+    """Drop all cached TMDB data, e.g. after a title was updated upstream."""
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    tmdb.clear_cache()
+    return jsonify({'success': True})
 
 
 # ---------------------------------------------------------------------------
@@ -8,6 +8,28 @@ TMDB_API_KEY = os.getenv('TMDB_API_KEY', '')
 TMDB_BASE_URL = 'https://api.themoviedb.org/3'
 TMDB_IMAGE_BASE = 'https://image.tmdb.org/t/p'
 
+# In-memory TMDB response cache lifetimes (seconds)
+TMDB_CACHE_TTL = 60 * 60             # search, details, per-title data
+TMDB_LONG_CACHE_TTL = 24 * 60 * 60   # provider catalogue, basic show info
+
+# On-disk (SQLite) TMDB cache lifetimes — survives restarts and deploys
+TMDB_DISK_PROVIDERS_TTL = 24 * 60 * 60
+TMDB_DISK_SEASON_TTL = 6 * 60 * 60
+
+# Outbound TMDB throttling. TMDB allows ~40 req/s per API key; the budget
+# below is shared by every gunicorn worker process, so each one gets a
+# slice (gunicorn.conf.py exports its worker count as WEB_CONCURRENCY; a
+# plain `python app.py` is a single process).
+TMDB_RATE_BUDGET = 35         # requests per second across all processes
+WEB_WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+TMDB_RATE_LIMIT = TMDB_RATE_BUDGET / max(1, WEB_WORKERS)   # per process
+TMDB_MAX_CONCURRENCY = 20     # simultaneous in-flight requests per process
+TMDB_429_RETRIES = 3          # extra attempts after a 429, each taking a token
+
+# Token required in the X-Admin-Token header for admin endpoints
+# (e.g. POST /api/_cache/clear). Leave empty to disable them outside debug.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
 # Primary watch region (ISO 3166-1 code)
 WATCH_REGION = 'EG'
 
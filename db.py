@@ -8,7 +8,11 @@ sent as the X-User-ID request header. No login required.
 import os
 import json
 import sqlite3
+import threading
+import time
 import uuid
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -20,29 +24,67 @@ os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 # Sentinel used for migrating legacy rows that had no user_id
 LEGACY_USER_ID = 'legacy'
 
+# SQL expression for "now" as a local ISO timestamp (matches the format of
+# rows written earlier with datetime.now().isoformat())
+SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+
+# Stand-in for legacy rows that never had an added_at: sorts before every
+# real timestamp, so those rows stay at the bottom as NULLs used to
+UNKNOWN_ADDED_AT = ''
+
+WATCHLIST_DDL = f'''
+    CREATE TABLE IF NOT EXISTS watchlist (
+        id           INTEGER NOT NULL,
+        media_type   TEXT    NOT NULL,
+        user_id      TEXT    NOT NULL DEFAULT '{LEGACY_USER_ID}',
+        title        TEXT,
+        poster_path  TEXT,
+        vote_average REAL DEFAULT 0,
+        release_date TEXT,
+        added_at     TEXT    NOT NULL DEFAULT ({SQL_NOW}),
+        PRIMARY KEY (id, media_type, user_id)
+    )
+'''
+
+
+_local = threading.local()
+
 
 def get_db():
-    """Get a database connection (creates/migrates tables on first use)."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA journal_mode=WAL')
-    _init_tables(conn)
+    """Return this thread's connection, opening it on first use.
+
+    Connections run in autocommit mode; use ``_transaction()`` to group
+    several writes atomically.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        _local.conn = conn
     return conn
 
 
+@contextmanager
+def _transaction():
+    """Run the enclosed statements as one write transaction."""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except BaseException:
+        # The connection lives for the whole thread, so never leave it
+        # inside a transaction — even when COMMIT itself fails
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+
+
 def _init_tables(conn):
     conn.executescript(f'''
-        CREATE TABLE IF NOT EXISTS watchlist (
-            id           INTEGER NOT NULL,
-            media_type   TEXT    NOT NULL,
-            user_id      TEXT    NOT NULL DEFAULT '{LEGACY_USER_ID}',
-            title        TEXT,
-            poster_path  TEXT,
-            vote_average REAL DEFAULT 0,
-            release_date TEXT,
-            added_at     TEXT,
-            PRIMARY KEY (id, media_type, user_id)
-        );
+        {WATCHLIST_DDL};
         CREATE TABLE IF NOT EXISTS users (
             id            TEXT PRIMARY KEY,
             email         TEXT UNIQUE NOT NULL,
@@ -50,9 +92,44 @@ def _init_tables(conn):
             password_hash TEXT NOT NULL,
             created_at    TEXT
         );
+        CREATE TABLE IF NOT EXISTS tmdb_cache (
+            path       TEXT    NOT NULL,
+            params     TEXT    NOT NULL,
+            body       BLOB    NOT NULL,
+            fetched_at INTEGER NOT NULL,
+            PRIMARY KEY (path, params)
+        );
     ''')
 
 
+def _migrate_added_at_default():
+    """Rebuild a watchlist table created before added_at had a SQL default."""
+    with _transaction() as conn:
+        cols = {r['name']: r for r in conn.execute('PRAGMA table_info(watchlist)')}
+        if cols['added_at']['dflt_value'] is not None:
+            return
+        conn.execute('ALTER TABLE watchlist RENAME TO watchlist_old')
+        conn.execute(WATCHLIST_DDL)
+        conn.execute(f'''
+            INSERT INTO watchlist
+                (id, media_type, user_id, title, poster_path, vote_average, release_date, added_at)
+            SELECT id, media_type, user_id, title, poster_path, vote_average, release_date,
+                   COALESCE(added_at, '{UNKNOWN_ADDED_AT}')
+            FROM watchlist_old
+        ''')
+        conn.execute('DROP TABLE watchlist_old')
+
+
+def _init_db():
+    """Switch the database to WAL and create tables — runs once at import."""
+    conn = get_db()
+    conn.execute('PRAGMA journal_mode=WAL')
+    _init_tables(conn)
+    _migrate_added_at_default()
+
+
+_init_db()
+
 
 # ---------------------------------------------------------------------------
 # Watchlist helpers
@@ -60,25 +137,16 @@ def _init_tables(conn):
 
 def load_watchlist(user_id: str):
     """Return the full watchlist for a given user as a list of dicts."""
-    conn = get_db()
-    try:
-        rows = conn.execute(
-            'SELECT * FROM watchlist WHERE user_id = ? ORDER BY added_at DESC',
-            (user_id,)
-        ).fetchall()
-        return [dict(r) for r in rows]
-    finally:
-        conn.close()
+    return load_watchlist_from(get_db(), user_id)
 
 
 def add_to_watchlist(item, user_id: str):
     """Insert a title for a user if it doesn't already exist. Return the full watchlist."""
-    conn = get_db()
-    try:
+    with _transaction() as conn:
         conn.execute('''
             INSERT OR IGNORE INTO watchlist
-                (id, media_type, user_id, title, poster_path, vote_average, release_date, added_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                (id, media_type, user_id, title, poster_path, vote_average, release_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             item['id'],
             item['media_type'],
@@ -87,32 +155,24 @@ def add_to_watchlist(item, user_id: str):
             item.get('poster_path', ''),
             item.get('vote_average', 0),
             item.get('release_date', ''),
-            datetime.now().isoformat(),
         ))
-        conn.commit()
         return load_watchlist_from(conn, user_id)
-    finally:
-        conn.close()
 
 
 def remove_from_watchlist(media_type, title_id, user_id: str):
     """Delete a title for a user. Return the updated watchlist."""
-    conn = get_db()
-    try:
+    with _transaction() as conn:
         conn.execute(
             'DELETE FROM watchlist WHERE id = ? AND media_type = ? AND user_id = ?',
             (title_id, media_type, user_id),
         )
-        conn.commit()
         return load_watchlist_from(conn, user_id)
-    finally:
-        conn.close()
 
 
 def load_watchlist_from(conn, user_id: str):
-    """Load watchlist using an existing connection (avoids re-opening)."""
+    """Load watchlist using a given connection (e.g. inside a transaction)."""
     rows = conn.execute(
-        'SELECT * FROM watchlist WHERE user_id = ? ORDER BY added_at DESC',
+        'SELECT * FROM watchlist WHERE user_id = ? ORDER BY added_at DESC, rowid DESC',
         (user_id,)
     ).fetchall()
     return [dict(r) for r in rows]
@@ -134,67 +194,83 @@ def migrate_json_watchlist():
     if not items:
         return
 
-    conn = get_db()
-    try:
-        for item in items:
-            conn.execute('''
-                INSERT OR IGNORE INTO watchlist
-                    (id, media_type, user_id, title, poster_path, vote_average, release_date, added_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                item.get('id'),
-                item.get('media_type', ''),
-                LEGACY_USER_ID,
-                item.get('title', ''),
-                item.get('poster_path', ''),
-                item.get('vote_average', 0),
-                item.get('release_date', ''),
-                item.get('added_at', datetime.now().isoformat()),
-            ))
-        conn.commit()
-    finally:
-        conn.close()
+    rows = [(
+        item.get('id'),
+        item.get('media_type', ''),
+        LEGACY_USER_ID,
+        item.get('title', ''),
+        item.get('poster_path', ''),
+        item.get('vote_average', 0),
+        item.get('release_date', ''),
+        # Missing key → now (via COALESCE); explicit null → oldest
+        (item['added_at'] or UNKNOWN_ADDED_AT) if 'added_at' in item else None,
+    ) for item in items]
+    with _transaction() as conn:
+        conn.executemany(f'''
+            INSERT OR IGNORE INTO watchlist
+                (id, media_type, user_id, title, poster_path, vote_average, release_date, added_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, {SQL_NOW}))
+        ''', rows)
 
     # Rename so we don't re-import
     os.rename(json_path, json_path + '.migrated')
     print(f'Migrated {len(items)} watchlist items from JSON to SQLite.')
 
 
+# ---------------------------------------------------------------------------
+# TMDB response cache (zlib-compressed bodies, survives restarts)
+# ---------------------------------------------------------------------------
+
+def get_cached_response(path: str, params: str, max_age: int):
+    """Return the cached body for (path, params) if younger than max_age seconds."""
+    row = get_db().execute(
+        'SELECT body, fetched_at FROM tmdb_cache WHERE path = ? AND params = ?',
+        (path, params),
+    ).fetchone()
+    if row and time.time() - row['fetched_at'] < max_age:
+        return zlib.decompress(row['body'])
+    return None
+
+
+def store_cached_response(path: str, params: str, body: bytes):
+    get_db().execute(
+        'INSERT OR REPLACE INTO tmdb_cache (path, params, body, fetched_at) VALUES (?, ?, ?, ?)',
+        (path, params, zlib.compress(body), int(time.time())),
+    )
+
+
+def purge_cached_responses(max_age: int):
+    """Drop cached responses older than max_age seconds."""
+    get_db().execute('DELETE FROM tmdb_cache WHERE fetched_at < ?',
+                     (int(time.time()) - max_age,))
+
+
+def clear_cached_responses():
+    get_db().execute('DELETE FROM tmdb_cache')
+
+
 # ---------------------------------------------------------------------------
 # User helpers
 # ---------------------------------------------------------------------------
 
 def create_user(username: str, email: str, password: str):
-    conn = get_db()
-    try:
-        user_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
-        conn.execute(
-            'INSERT INTO users (id, email, username, password_hash, created_at) VALUES (?, ?, ?, ?, ?)',
-            (user_id, email, username, generate_password_hash(password), now),
-        )
-        conn.commit()
-        return {'id': user_id, 'email': email, 'username': username}
-    finally:
-        conn.close()
+    user_id = str(uuid.uuid4())
+    now = datetime.now().isoformat()
+    get_db().execute(
+        'INSERT INTO users (id, email, username, password_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+        (user_id, email, username, generate_password_hash(password), now),
+    )
+    return {'id': user_id, 'email': email, 'username': username}
 
 
 def get_user_by_email(email: str):
-    conn = get_db()
-    try:
-        row = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    row = get_db().execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+    return dict(row) if row else None
 
 
 def get_user_by_id(user_id: str):
-    conn = get_db()
-    try:
-        row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    row = get_db().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return dict(row) if row else None
 
 
 def verify_user(email: str, password: str):
@@ -210,8 +286,7 @@ def merge_watchlist(from_user_id: str, to_user_id: str):
     then delete the anonymous copies."""
     if not from_user_id or from_user_id == to_user_id:
         return
-    conn = get_db()
-    try:
+    with _transaction() as conn:
         rows = conn.execute(
             'SELECT * FROM watchlist WHERE user_id = ?', (from_user_id,)
         ).fetchall()
@@ -223,6 +298,3 @@ def merge_watchlist(from_user_id: str, to_user_id: str):
             ''', (row['id'], row['media_type'], to_user_id, row['title'],
                   row['poster_path'], row['vote_average'], row['release_date'], row['added_at']))
         conn.execute('DELETE FROM watchlist WHERE user_id = ?', (from_user_id,))
-        conn.commit()
-    finally:
-        conn.close()
@@ -0,0 +1,17 @@
+"""
+Gunicorn settings — picked up automatically by `gunicorn wsgi:app`.
+
+Requests spend most of their time waiting on TMDB, so a couple of processes
+with many threads each (gthread) serve far more concurrent users than the
+default sync worker. Each process keeps its own TMDB caches and IO_POOL.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Inherited by the workers, where config.py splits the TMDB rate budget by it
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+worker_connections = 200
+timeout = 120
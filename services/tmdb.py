@@ -1,5 +1,22 @@
+import json
+import operator
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import orjson
 import requests
-from config import TMDB_API_KEY, TMDB_BASE_URL, WATCH_REGION, GERMAN_REGION
+from cachetools import TTLCache, cachedmethod
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (TMDB_API_KEY, TMDB_BASE_URL, WATCH_REGION, GERMAN_REGION,
+                    TMDB_CACHE_TTL, TMDB_LONG_CACHE_TTL,
+                    TMDB_DISK_PROVIDERS_TTL, TMDB_DISK_SEASON_TTL,
+                    TMDB_RATE_LIMIT, TMDB_MAX_CONCURRENCY, TMDB_429_RETRIES)
+from db import (get_cached_response, store_cached_response, purge_cached_responses,
+                clear_cached_responses)
 
 
 class TMDBError(Exception):
@@ -7,13 +24,135 @@ class TMDBError(Exception):
     pass
 
 
+def _disk_ttl(path, params=None):
+    """How long a response may be served from SQLite (None = never).
+
+    The provider catalogue (/watch/providers/{type}) is deliberately left
+    out — TMDBService._providers_cache is its only cache.
+    """
+    if path.endswith('/watch/providers'):
+        return TMDB_DISK_PROVIDERS_TTL
+    if 'season/' in (params or {}).get('append_to_response', ''):
+        return TMDB_DISK_SEASON_TTL
+    return None
+
+
+def _cached_details(kind):
+    """Serve a details payload from the service's TTL details cache, keyed by (kind, id).
+
+    The wrapped method must fetch with ``cached=False`` so the payload is not
+    held a second time in the general response cache.
+    """
+    return cachedmethod(operator.attrgetter('_details_cache'),
+                        key=lambda self, item_id: (kind, item_id),
+                        lock=operator.attrgetter('_details_lock'))
+
+
+class SingleFlight:
+    """Collapse concurrent calls sharing a key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+def _retry_after(resp, attempt):
+    """Seconds to wait before retrying a 429 (Retry-After, else backoff)."""
+    try:
+        wait = float(resp.headers.get('Retry-After', ''))
+    except ValueError:
+        wait = 0.3 * 2 ** attempt
+    return min(max(wait, 0.0), 10.0)   # never park a worker thread for long
+
+
+class RateLimiter:
+    """Token bucket: *rate* requests per second, with bursts of up to *rate*."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1, rate)   # a fractional rate must still fit a token
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # Jitter so waiting threads don't all wake in lockstep
+            time.sleep(wait * random.uniform(1, 1.5))
+
+
 class TMDBService:
-    """Wrapper around The Movie Database (TMDB) API v3."""
+    """Wrapper around The Movie Database (TMDB) API v3.
+
+    Responses are cached in memory, so the returned payloads are shared
+    between callers and must be treated as read-only.
+    """
 
     def __init__(self):
         self.base = TMDB_BASE_URL
         self.session = requests.Session()
         self.session.params = {'api_key': TMDB_API_KEY}
+        self.session.headers['Connection'] = 'keep-alive'
+        # Pool sized above the app's IO_POOL so parallel calls reuse TLS
+        # connections; transient 5xx are retried with backoff. 429 is left
+        # to _request so those retries go back through the rate limiter.
+        retries = Retry(total=3, backoff_factor=0.3,
+                        status_forcelist=(500, 502, 503, 504),
+                        allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=20, pool_maxsize=64,
+                              max_retries=retries)
+        self.session.mount('https://', adapter)
+        # Throttle cache misses so bursts (e.g. a 100-title optimize) don't
+        # trip TMDB's rate limit. urllib3's 5xx retries happen inside
+        # session.get and don't take a token; 429 retries do (_request).
+        self._rate_limiter = RateLimiter(TMDB_RATE_LIMIT)
+        self._concurrency = threading.BoundedSemaphore(TMDB_MAX_CONCURRENCY)
+        self._cache = TTLCache(maxsize=2048, ttl=TMDB_CACHE_TTL)
+        self._long_cache = TTLCache(maxsize=512, ttl=TMDB_LONG_CACHE_TTL)
+        self._cache_lock = threading.RLock()
+        self._inflight = SingleFlight()
+        # Provider catalogue per media type: (fetched_at, data). Kept apart
+        # from the TTL caches so it can't be evicted by per-show entries.
+        self._providers_cache = {'movie': (0, None), 'tv': (0, None)}
+        # Detail pages are reopened often within a session; keep them hot,
+        # but still refresh hourly so embedded watch/providers stay current
+        self._details_cache = TTLCache(maxsize=512, ttl=TMDB_CACHE_TTL)
+        self._details_lock = threading.Lock()
+        purge_cached_responses(max(TMDB_DISK_PROVIDERS_TTL, TMDB_DISK_SEASON_TTL))
 
     # ------------------------------------------------------------------
     # Search
@@ -45,24 +184,27 @@ class TMDBService:
     # Details (with appended sub-requests for efficiency)
     # ------------------------------------------------------------------
 
+    @_cached_details('movie')
     def get_movie_details(self, movie_id):
         return self._get(f'/movie/{movie_id}', {
             'append_to_response': 'watch/providers,credits,external_ids',
-        })
+        }, cached=False)
 
+    @_cached_details('tv')
     def get_tv_details(self, tv_id):
         return self._get(f'/tv/{tv_id}', {
             'append_to_response': 'watch/providers,credits,external_ids',
-        })
+        }, cached=False)
 
     # ------------------------------------------------------------------
     # People
     # ------------------------------------------------------------------
 
+    @_cached_details('person')
     def get_person(self, person_id):
         return self._get(f'/person/{person_id}', {
             'append_to_response': 'combined_credits',
-        })
+        }, cached=False)
 
     # ------------------------------------------------------------------
     # Watch providers
@@ -78,10 +220,16 @@ class TMDBService:
         }
 
     def get_available_providers(self, media_type):
-        """List every provider available in the watch region."""
-        return self._get(f'/watch/providers/{media_type}', {
+        """List every provider available in the watch region (cached for a day)."""
+        fetched_at, data = self._providers_cache.get(media_type, (0, None))
+        if data is not None and time.time() - fetched_at < TMDB_LONG_CACHE_TTL:
+            return data
+
+        data = self._get(f'/watch/providers/{media_type}', {
             'watch_region': WATCH_REGION,
-        })
+        }, cached=False)
+        self._providers_cache[media_type] = (time.time(), data)
+        return data
 
     # ------------------------------------------------------------------
     # Seasons / Episodes
@@ -89,28 +237,94 @@ class TMDBService:
 
     def get_tv_basic(self, tv_id):
         """Light TV details — just enough to find upcoming episodes."""
-        return self._get(f'/tv/{tv_id}')
+        return self._get(f'/tv/{tv_id}', long_lived=True)
+
+    def get_seasons(self, tv_id, season_numbers):
+        """Get several seasons in one call via append_to_response.
+
+        Returns ``{season_number: season_data}`` for the seasons TMDB sent.
+        """
+        numbers = sorted(season_numbers)
+        data = self._get(f'/tv/{tv_id}', {
+            'append_to_response': ','.join(f'season/{n}' for n in numbers),
+        })
+        return {n: data[f'season/{n}'] for n in numbers if f'season/{n}' in data}
 
-    def get_season(self, tv_id, season_number):
-        """Get all episodes for a specific season."""
-        return self._get(f'/tv/{tv_id}/season/{season_number}')
+    # ------------------------------------------------------------------
+    # Cache control
+    # ------------------------------------------------------------------
+
+    def clear_cache(self):
+        """Forget every cached TMDB response, in memory and in SQLite."""
+        with self._details_lock:
+            self._details_cache.clear()
+        with self._cache_lock:
+            self._cache.clear()
+            self._long_cache.clear()
+        self._providers_cache = {'movie': (0, None), 'tv': (0, None)}
+        clear_cached_responses()
 
     # ------------------------------------------------------------------
     # Internal
     # ------------------------------------------------------------------
 
-    def _get(self, path, params=None):
+    def _get(self, path, params=None, long_lived=False, cached=True):
+        """GET *path*, serving repeats from the TTL cache.
+
+        On a cache miss, identical requests already in flight on other
+        threads are joined instead of issued again. ``long_lived`` selects
+        the 24 h cache for data that rarely changes; ``cached=False`` skips
+        the memory cache for callers that keep their own.
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        if not cached:
+            return self._inflight.do(key, lambda: orjson.loads(self._fetch(path, params)))
+
+        cache = self._long_cache if long_lived else self._cache
+        with self._cache_lock:
+            data = cache.get(key)
+        if data is not None:
+            return data
+
+        def _load():
+            data = orjson.loads(self._fetch(path, params))
+            with self._cache_lock:
+                cache[key] = data
+            return data
+
+        return self._inflight.do(key, _load)
+
+    def _fetch(self, path, params=None):
+        """Return the raw response body, going through SQLite where allowed."""
+        disk_ttl = _disk_ttl(path, params)
+        if disk_ttl is None:
+            return self._request(path, params)
+
+        params_key = json.dumps(sorted((params or {}).items()))
+        body = get_cached_response(path, params_key, disk_ttl)
+        if body is None:
+            body = self._request(path, params)
+            store_cached_response(path, params_key, body)
+        return body
+
+    def _request(self, path, params=None):
         if not TMDB_API_KEY or TMDB_API_KEY == 'your_api_key_here':
             raise TMDBError(
                 'TMDB API key not configured. '
                 'Get a free key at https://www.themoviedb.org/settings/api '
                 'and add it to your .env file.'
             )
-        resp = self.session.get(f'{self.base}{path}', params=params or {})
+        for attempt in range(TMDB_429_RETRIES + 1):
+            self._rate_limiter.acquire()
+            with self._concurrency:
+                resp = self.session.get(f'{self.base}{path}', params=params or {})
+            if resp.status_code != 429 or attempt == TMDB_429_RETRIES:
+                break
+            time.sleep(_retry_after(resp, attempt))
         if resp.status_code == 401:
             raise TMDBError(
                 'Invalid TMDB API key. Check your .env file and make sure '
                 'the key is correct.'
             )
         resp.raise_for_status()
-        return resp.json()
+        return resp.content
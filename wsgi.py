@@ -1,6 +1,6 @@
 """
 WSGI entry point for production servers (gunicorn, PythonAnywhere, etc.)
-Usage:  gunicorn wsgi:app
+Usage:  gunicorn wsgi:app   (settings in gunicorn.conf.py)
 """
 from app import app
 